@@ -0,0 +1,18 @@
+from functools import cache
+
+import adsk.core
+
+
+@cache
+def get_app() -> adsk.core.Application:
+    """Fusionのアプリケーションオブジェクトを取得する
+
+    アドインの実行中は同じインスタンスなので、一度だけ取得して使い回す。
+    """
+    return adsk.core.Application.get()
+
+
+@cache
+def get_ui() -> adsk.core.UserInterface:
+    """FusionのUserInterfaceオブジェクトを取得する"""
+    return get_app().userInterface
@@ -1,7 +1,11 @@
-import io
+import itertools
+import os
+import threading
 import traceback
-import uuid
-from dataclasses import dataclass
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import CodeType
 from typing import Any
 
 import adsk
@@ -11,6 +15,33 @@ import adsk.fusion
 
 from ....lib import fusionAddInUtils as futil
 from ..errors import FusionExecutionError, InvalidUserInputError
+from ..fusion_handles import get_app, get_ui
+
+USER_CODE_FILENAME = "<fusion-mcp-exec>"
+
+_command_counter = itertools.count()
+"""一時的なコマンドのIDに使う連番"""
+
+COMMAND_WAIT_INTERVAL = 0.005
+"""コマンドの終了を待つ間、Fusionのイベントを処理する間隔(秒)"""
+
+_handler_pool: defaultdict[type, list[Any]] = defaultdict(list)
+"""実行を終えたイベントハンドラを型ごとに保持し、次の実行で再利用するためのプール"""
+
+_STATIC_NAMESPACE: dict[str, Any] = {
+    "adsk": adsk,
+    "traceback": traceback,
+}
+"""スクリプト実行時の名前空間のうち、実行ごとに変わらない部分"""
+
+
+@lru_cache(maxsize=128)
+def _compile_user_code(code: str) -> CodeType:
+    """渡されたコードをコンパイルする
+
+    エージェントは同じスクリプトを繰り返し送ることがあるため、コードオブジェクトをキャッシュする。
+    """
+    return compile(code, USER_CODE_FILENAME, "exec")
 
 
 @dataclass
@@ -24,68 +55,93 @@ class CommandExecutionState:
     code_result: str | None = None
     """コードの実行結果
 
-    標準入出力・コード内でのエラーのトレースバック"""
+    エラーが発生した場合は、発生したときまでの標準出力"""
+
+    code_error: Exception | None = None
+    """渡されたコードで発生したエラー
+
+    トレースバックはレスポンスを作成するときに整形する。
+    """
 
     fusion_error: Exception | None = None
     """Fusionのコマンド側で発生したエラー
 
-    渡されたコードで発生したエラーはoutputに保存される。
+    渡されたコードで発生したエラーはcode_errorに保存される。
     """
 
-    is_finished: bool = False
+    done_event: threading.Event = field(default_factory=threading.Event)
+    """コマンドの実行が終了したときにセットされるイベント"""
 
 
 class CommandExecuteHandler(adsk.core.CommandEventHandler):
-    """実際のコード実行を担当するイベントハンドラ"""
+    """実際のコード実行を担当するイベントハンドラ
+
+    プールから再利用されるため、実行ごとの値は`attach`で設定する。
+    """
 
-    def __init__(
+    code_to_exec: CodeType | None
+    namespace: dict[str, Any]
+    result_container: CommandExecutionState | None
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.detach()
+
+    def attach(
         self,
-        code_to_exec: str,
+        code_to_exec: CodeType,
         namespace: dict[str, Any],
         result_container: CommandExecutionState,
     ) -> None:
-        """CommandExecuteイベントハンドラ
+        """実行ごとの値を設定する
 
         Args:
-            code_to_exec (str): 実行するPythonコード
+            code_to_exec (CodeType): 実行するコンパイル済みのPythonコード
             namespace (dict[str, Any]): 実行時に使用する名前空間
             result_container (ExecutionContainer): コマンドの実行結果を保存するためのコンテナ
 
         """
-        super().__init__()
         self.code_to_exec = code_to_exec
         self.namespace = namespace
         self.result_container = result_container
 
+    def detach(self) -> None:
+        """プールに戻す前に、前回の実行への参照を外す"""
+        self.code_to_exec = None
+        self.namespace = {}
+        self.result_container = None
+
     def notify(self, _args: adsk.core.CommandEventArgs) -> None:
         """コマンドが実行されたときに呼び出され、渡されたコードを実行する"""
-        # 出力をキャプチャするためのバッファ
-        capture_buffer = io.StringIO()
-
-        try:
-
-            def custom_print(*values: object) -> None:
-                log_msg = " ".join(str(arg) for arg in values)
-                futil.log(log_msg, force_console=True)
+        code_to_exec = self.code_to_exec
+        result_container = self.result_container
+        if code_to_exec is None or result_container is None:
+            # プールに戻されたハンドラに届いたイベントは無視する
+            return
 
-                print(*values, file=capture_buffer)
+        # 出力をキャプチャするためのバッファ
+        # 整形済みの文字列を溜めておき、最後に一度だけ結合する
+        capture_chunks: list[str] = []
 
-            local_namespace = self.namespace.copy()
-            local_namespace["print"] = custom_print
+        def custom_print(*values: object) -> None:
+            log_msg = " ".join(map(str, values))
+            futil.log(log_msg, force_console=True)
 
-            # exec関数で文字列として渡されたコードを実行
-            exec(self.code_to_exec, local_namespace)  # noqa: S102
+            capture_chunks.append(log_msg)
+            capture_chunks.append("\n")
 
-            # 実行結果をコンテナに保存
-            self.result_container.code_result = capture_buffer.getvalue()
+        local_namespace = dict(self.namespace, print=custom_print)
 
-        except Exception:
-            output = capture_buffer.getvalue()  # エラーが発生したときまでの標準出力
-            error_traceback = traceback.format_exc()
-            self.result_container.code_result = f"{output}\n--- TRACEBACK ---\n{error_traceback}"
+        try:
+            # exec関数でコンパイル済みのコードを実行
+            exec(code_to_exec, local_namespace)  # noqa: S102
+        except Exception as e:
+            # トレースバックの整形は結果を返すときまで遅らせる
+            result_container.code_error = e
 
-        finally:
-            capture_buffer.close()
+        # 実行結果をコンテナに保存
+        # エラーが発生した場合は、発生したときまでの標準出力
+        result_container.code_result = "".join(capture_chunks)
 
 
 class CommandDestroyHandler(adsk.core.CommandEventHandler):
@@ -94,11 +150,26 @@ class CommandDestroyHandler(adsk.core.CommandEventHandler):
     一時的に定義したコマンドを実行し終えたときに自動で定義を消去する
     """
 
-    def __init__(self, result_container: CommandExecutionState) -> None:
+    result_container: CommandExecutionState | None
+
+    def __init__(self) -> None:
         super().__init__()
+        self.detach()
+
+    def attach(self, result_container: CommandExecutionState) -> None:
+        """実行ごとの値を設定する"""
         self.result_container = result_container
 
+    def detach(self) -> None:
+        """プールに戻す前に、前回の実行への参照を外す"""
+        self.result_container = None
+
     def notify(self, args: adsk.core.CommandEventArgs) -> None:
+        result_container = self.result_container
+        if result_container is None:
+            # プールに戻されたハンドラに届いたイベントは無視する
+            return
+
         try:
             # イベントの引数からコマンド定義を取得して削除する
             # これで安全なタイミングでクリーンアップできる
@@ -108,22 +179,31 @@ class CommandDestroyHandler(adsk.core.CommandEventHandler):
         except Exception as e:
             futil.handle_error(f"Failed to delete command definition: {e!s}")
         finally:
-            # コマンドの実行が終了したことをコンテナに記録
-            self.result_container.is_finished = True
+            # コマンドの実行が終了したことを待機側に通知
+            result_container.done_event.set()
 
 
 class CommandCreatedHandler(adsk.core.CommandCreatedEventHandler):
-    def __init__(
+    code_to_exec: CodeType | None
+    namespace: dict[str, Any]
+    result_container: CommandExecutionState | None
+    handlers: list[adsk.core.CommandEventHandler]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.detach()
+
+    def attach(
         self,
-        code_to_exec: str,
+        code_to_exec: CodeType,
         namespace: dict,
         result_container: CommandExecutionState,
         handlers_list: list[adsk.core.CommandEventHandler],
     ) -> None:
-        """CommandCreatedイベントハンドラ
+        """実行ごとの値を設定する
 
         Args:
-            code_to_exec (str): 実行するPythonコード
+            code_to_exec (CodeType): 実行するコンパイル済みのPythonコード
             namespace (dict): 実行時に使用する名前空間
             result_container (ExecutionResult): コマンドの実行結果を保存するためのコンテナ。
                 このクラスの中でコンテナの属性が変更される。
@@ -131,26 +211,40 @@ class CommandCreatedHandler(adsk.core.CommandCreatedEventHandler):
                 イベントハンドラのリスト
 
         """
-        super().__init__()
         self.code_to_exec = code_to_exec
         self.namespace = namespace
         self.result_container = result_container
         self.handlers = handlers_list
 
+    def detach(self) -> None:
+        """プールに戻す前に、前回の実行への参照を外す"""
+        self.code_to_exec = None
+        self.namespace = {}
+        self.result_container = None
+        self.handlers = []
+
     def notify(self, args: adsk.core.CommandEventArgs) -> None:
+        code_to_exec = self.code_to_exec
+        result_container = self.result_container
+        if code_to_exec is None or result_container is None:
+            # プールに戻されたハンドラに届いたイベントは無視する
+            return
+
         try:
             cmd = adsk.core.Command.cast(args.command)
 
             # CommandExecuteイベントハンドラを接続
-            on_execute = CommandExecuteHandler(
-                self.code_to_exec,
+            on_execute = _acquire_handler(CommandExecuteHandler)
+            on_execute.attach(
+                code_to_exec,
                 self.namespace,
-                self.result_container,
+                result_container,
             )
             self.handlers.append(on_execute)
             cmd.execute.add(on_execute)
 
-            on_destroy = CommandDestroyHandler(self.result_container)
+            on_destroy = _acquire_handler(CommandDestroyHandler)
+            on_destroy.attach(result_container)
             self.handlers.append(on_destroy)
             cmd.destroy.add(on_destroy)
 
@@ -158,12 +252,25 @@ class CommandCreatedHandler(adsk.core.CommandCreatedEventHandler):
             cmd.isAutoExecute = True
 
         except Exception:
-            self.result_container.fusion_error = FusionExecutionError(
+            result_container.fusion_error = FusionExecutionError(
                 "Failed to set up the command execution environment.",
             )
 
             # エラー時に、強制的に終了状態にする
-            self.result_container.is_finished = True
+            result_container.done_event.set()
+
+
+def _acquire_handler[H](handler_type: type[H]) -> H:
+    """プールからイベントハンドラを取り出す。空であれば新しく作成する"""
+    pool = _handler_pool[handler_type]
+    return pool.pop() if pool else handler_type()
+
+
+def _release_handlers(handlers: list[Any]) -> None:
+    """実行を終えたイベントハンドラをプールに戻す"""
+    for handler in handlers:
+        handler.detach()
+        _handler_pool[type(handler)].append(handler)
 
 
 def execute_code_in_transaction(
@@ -179,14 +286,23 @@ def execute_code_in_transaction(
     Returns:
         str: 実行結果の文字列（標準出力）
 
+    Raises:
+        InvalidUserInputError: コードが空、または構文エラーを含む場合
+
     """
     if not code:
         raise InvalidUserInputError("Parameter 'code' cannot be empty")
     if not transaction_name:
         transaction_name = "Python Script Execution"
 
-    app = adsk.core.Application.get()
-    ui = app.userInterface
+    # コマンドを作成する前にコンパイルし、構文エラーはその場で返す
+    try:
+        compiled_code = _compile_user_code(code)
+    except (SyntaxError, ValueError) as e:
+        raise InvalidUserInputError(f"Failed to compile code: {e}") from e
+
+    app = get_app()
+    ui = get_ui()
     cmd_def = None
 
     # イベントハンドラがGCされないように参照を保持するリスト
@@ -197,18 +313,18 @@ def execute_code_in_transaction(
 
     try:
         # 他のコマンドと衝突しないように一意なIDを生成
-        # 一時的なコマンドのIDなのでランダムでOK
-        command_id = f"temp_transactional_executor_{uuid.uuid4()}"
+        # 一時的なコマンドのIDなので、プロセス内の連番で十分
+        command_id = f"temp_transactional_executor_{os.getpid()}_{next(_command_counter)}"
 
         # スクリプト実行時に使用できる変数を用意
+        # 固定の部分にアクティブなデザインに依存する変数を重ねる
         design = adsk.fusion.Design.cast(app.activeProduct)
         namespace = {
-            "adsk": adsk,
+            **_STATIC_NAMESPACE,
             "app": app,
             "ui": ui,
             "design": design,
             "root_comp": design.rootComponent if design else None,
-            "traceback": traceback,
         }
 
         # 一時的なコマンドを作成
@@ -219,8 +335,9 @@ def execute_code_in_transaction(
             transaction_name,
         )
 
-        on_created = CommandCreatedHandler(
-            code,
+        on_created = _acquire_handler(CommandCreatedHandler)
+        on_created.attach(
+            compiled_code,
             namespace,
             result_container=container,
             handlers_list=handlers,
@@ -230,20 +347,42 @@ def execute_code_in_transaction(
 
         cmd_def.execute()
 
-        while not container.is_finished:
+        while not container.done_event.wait(timeout=COMMAND_WAIT_INTERVAL):
             # コマンドの実行が終了するまで待機
-            # Fusionのコマンドは非同期で実行されるため、ここで待機する
+            # Fusionのコマンドは非同期で実行されるため、終了していなければイベントを処理する
             adsk.doEvents()
 
         if container.fusion_error:
             raise container.fusion_error  # noqa: TRY301
 
+        # コマンドが破棄されるまで実行されたので、ハンドラは次の実行で再利用できる
+        # エラー時は後からイベントが届く可能性があるため、プールには戻さない
+        _release_handlers(handlers)
+
+    except (FusionExecutionError, InvalidUserInputError):
+        raise
     except Exception as e:
-        if isinstance(e, (FusionExecutionError, InvalidUserInputError)):
-            raise
         futil.handle_error(
             f"An unexpected error occurred while executing code in transaction: {e!s}",
         )
         raise FusionExecutionError("An unexpected infrastructure error occurred.") from e
 
-    return container.code_result or ""
+    output = container.code_result or ""
+    if container.code_error is None:
+        return output
+
+    error_traceback = "".join(traceback.format_exception(container.code_error))
+    return f"{output}\n--- TRACEBACK ---\n{error_traceback}"
+
+
+def execute_code_in_transaction_from_params(params: dict[str, Any]) -> str:
+    """リクエストのパラメータ辞書からexecute_code_in_transactionを呼び出す
+
+    Args:
+        params (dict[str, Any]): `code`と`transaction_name`（省略可）を含む辞書
+
+    Returns:
+        str: 実行結果の文字列（標準出力）
+
+    """
+    return execute_code_in_transaction(params.get("code", ""), params.get("transaction_name"))
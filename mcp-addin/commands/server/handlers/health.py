@@ -1,6 +1,14 @@
+from typing import Any
+
+
 def health() -> dict[str, str]:
     """Fusion add-in readiness probe."""
     return {
         "status": "ok",
         "service": "mcp-addin",
     }
+
+
+def health_from_params(_params: dict[str, Any]) -> dict[str, str]:
+    """リクエストのパラメータ辞書からhealthを呼び出す"""
+    return health()
@@ -1,10 +1,10 @@
-from typing import TypedDict
+from typing import Any, TypedDict
 
-import adsk.core
 import adsk.fusion
 from adsk.fusion import Parameter
 
 from ..errors import FusionExecutionError, InvalidUserInputError
+from ..fusion_handles import get_app
 
 
 class FusionParameter(TypedDict):
@@ -42,16 +42,26 @@ def get_user_parameters() -> list[FusionParameter]:
         list[dict]: ユーザーパラメータのリスト
 
     """
-    app = adsk.core.Application.get()
-    if not app.activeProduct:
+    active_product = get_app().activeProduct
+    if not active_product:
         raise FusionExecutionError("No active design found")
 
-    design = adsk.fusion.Design.cast(app.activeProduct)
+    design = adsk.fusion.Design.cast(active_product)
     if not design:
         raise FusionExecutionError("Active product is not a design")
 
+    # コレクションは一度だけ取得し、辞書はループ内で直接組み立てる
     user_params = design.userParameters.asArray()
-    return [parameter_to_dict(param) for param in user_params]
+    return [
+        {
+            "name": param.name,
+            "value": param.value,
+            "unit": param.unit,
+            "expression": param.expression,
+            "comment": param.comment or "",
+        }
+        for param in user_params
+    ]
 
 
 def set_parameter(param_name: str, expression: str) -> FusionParameter:
@@ -76,11 +86,11 @@ def set_parameter(param_name: str, expression: str) -> FusionParameter:
     if not expression:
         raise InvalidUserInputError("Parameter 'expression' cannot be empty")
 
-    app = adsk.core.Application.get()
-    if not app.activeProduct:
+    active_product = get_app().activeProduct
+    if not active_product:
         raise FusionExecutionError("No active design found")
 
-    design = adsk.fusion.Design.cast(app.activeProduct)
+    design = adsk.fusion.Design.cast(active_product)
     if not design:
         raise FusionExecutionError("Active product is not a design")
 
@@ -89,7 +99,121 @@ def set_parameter(param_name: str, expression: str) -> FusionParameter:
         raise FusionExecutionError(f"Parameter '{param_name}' not found")
 
     try:
-        parameter.expression = expression
-        return parameter_to_dict(parameter)
+        return _apply_expression(parameter, expression)
     except Exception as e:
         raise FusionExecutionError(f"Failed to set parameter '{param_name}': {e}") from e
+
+
+def _apply_expression(parameter: Parameter, expression: str) -> FusionParameter:
+    """パラメータに式を設定し、設定後の情報を返す"""
+    parameter.expression = expression
+    return parameter_to_dict(parameter)
+
+
+def set_parameters_batch(items: list[dict[str, Any]]) -> list[FusionParameter]:
+    """複数のパラメータの値をまとめて設定する
+
+    ユーザーパラメータ・モデルパラメータの両方に対応。
+    すべての項目を検証してから、指定された順に設定する。
+
+    Args:
+        items (list[dict]): `param_name`と`expression`を含む辞書のリスト
+
+    Returns:
+        list[dict]: 設定後のパラメータ情報のリスト
+
+    Raises:
+        InvalidUserInputError: 入力が不正な場合
+        FusionExecutionError: パラメータの設定に失敗した場合。
+            失敗した項目より前の項目は設定済みのまま残る。
+
+    """
+    if not items:
+        raise InvalidUserInputError("Parameter 'items' cannot be empty")
+
+    active_product = get_app().activeProduct
+    if not active_product:
+        raise FusionExecutionError("No active design found")
+
+    design = adsk.fusion.Design.cast(active_product)
+    if not design:
+        raise FusionExecutionError("Active product is not a design")
+
+    # 途中で失敗して一部だけ設定されることを避けるため、先にすべて検証する
+    targets = _resolve_batch_items(design.allParameters, items)
+
+    results: list[FusionParameter] = []
+    for parameter, expression in targets:
+        try:
+            results.append(_apply_expression(parameter, expression))
+        except Exception as e:
+            raise FusionExecutionError(
+                f"Failed to set parameter '{parameter.name}': {e}. "
+                f"{len(results)} parameter(s) before it were already updated.",
+            ) from e
+
+    return results
+
+
+def _resolve_batch_items(
+    all_params: adsk.fusion.ParameterList,
+    items: list[dict[str, Any]],
+) -> list[tuple[Parameter, str]]:
+    """一括設定の各項目を検証し、対象のパラメータと設定する式の組に変換する
+
+    Raises:
+        InvalidUserInputError: 項目の形式が不正な場合
+        FusionExecutionError: パラメータが見つからない場合
+
+    """
+    targets: list[tuple[Parameter, str]] = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            raise InvalidUserInputError(f"items[{index}] must be an object")
+        param_name = item.get("param_name")
+        expression = item.get("expression")
+        if not param_name:
+            raise InvalidUserInputError(f"items[{index}]: 'param_name' cannot be empty")
+        if not expression:
+            raise InvalidUserInputError(f"items[{index}]: 'expression' cannot be empty")
+
+        parameter = all_params.itemByName(param_name)
+        if not parameter:
+            raise FusionExecutionError(f"Parameter '{param_name}' not found")
+        targets.append((parameter, expression))
+
+    return targets
+
+
+def get_user_parameters_from_params(_params: dict[str, Any]) -> list[FusionParameter]:
+    """リクエストのパラメータ辞書からget_user_parametersを呼び出す"""
+    return get_user_parameters()
+
+
+def set_parameter_from_params(params: dict[str, Any]) -> FusionParameter:
+    """リクエストのパラメータ辞書からset_parameterを呼び出す
+
+    Args:
+        params (dict[str, Any]): `param_name`と`expression`を含む辞書
+
+    Returns:
+        dict: 設定後のパラメータ情報
+
+    """
+    return set_parameter(params.get("param_name", ""), params.get("expression", ""))
+
+
+def set_parameters_batch_from_params(params: dict[str, Any]) -> list[FusionParameter]:
+    """リクエストのパラメータ辞書からset_parameters_batchを呼び出す
+
+    Args:
+        params (dict[str, Any]): `items`を含む辞書
+
+    Returns:
+        list[dict]: 設定後のパラメータ情報のリスト
+
+    """
+    items = params.get("items")
+    if items is not None and not isinstance(items, list):
+        raise InvalidUserInputError("Parameter 'items' must be a list")
+    return set_parameters_batch(items or [])
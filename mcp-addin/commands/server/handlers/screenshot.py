@@ -1,6 +1,19 @@
-import adsk.core
+import base64
+import os
+import tempfile
+from pathlib import Path
+from typing import Any
 
 from ..errors import FusionExecutionError, InvalidUserInputError
+from ..fusion_handles import get_app
+
+_INLINE_SCREENSHOT_PATH = (
+    Path(tempfile.gettempdir()) / f"fusion_mcp_viewport_screenshot_{os.getpid()}.png"
+)
+"""インラインのスクリーンショットで使い回す一時ファイルのパス
+
+アクションはFusionServerで1つずつ実行されるため、同時に使われることはない。
+"""
 
 
 def get_viewport_screenshot(filepath: str) -> dict[str, str]:
@@ -22,8 +35,7 @@ def get_viewport_screenshot(filepath: str) -> dict[str, str]:
     if not filepath:
         raise InvalidUserInputError("Parameter 'filepath' cannot be empty")
 
-    app = adsk.core.Application.get()
-    viewport = app.activeViewport
+    viewport = get_app().activeViewport
 
     if not viewport:
         raise FusionExecutionError("No active viewport found. Cannot take screenshot.")
@@ -36,3 +48,55 @@ def get_viewport_screenshot(filepath: str) -> dict[str, str]:
         raise FusionExecutionError(f"Failed to save screenshot to {filepath}")
 
     return {"filepath": filepath}
+
+
+def get_viewport_screenshot_from_params(params: dict[str, Any]) -> dict[str, str]:
+    """リクエストのパラメータ辞書からget_viewport_screenshotを呼び出す
+
+    Args:
+        params (dict[str, Any]): `filepath`を含む辞書
+
+    Returns:
+        dict:
+            - "filepath": 保存されたファイルのパス
+
+    """
+    return get_viewport_screenshot(params.get("filepath", ""))
+
+
+def get_viewport_screenshot_inline() -> dict[str, str]:
+    """ビューポートのスクリーンショットを撮り、PNGのデータをBase64で返す
+
+    MCPサーバー側でファイルを読み書きせずに済むように、画像データをレスポンスに含める。
+    Fusion APIはファイルへの保存しか提供しないため、アドイン内で一時ファイルを経由する。
+
+    Raises:
+        FusionExecutionError:
+            ビューポートが見つからない場合や、スクリーンショットの保存に失敗した場合に発生
+
+    Returns:
+        dict:
+            - "png_base64": Base64でエンコードされたPNGのデータ
+
+    """
+    filepath = _INLINE_SCREENSHOT_PATH
+
+    try:
+        get_viewport_screenshot(str(filepath))
+        # 存在確認はせず、読み込みの失敗で判定する
+        image_bytes = filepath.read_bytes()
+    except FileNotFoundError as e:
+        raise FusionExecutionError(
+            "Screenshot was not created by Fusion. This may indicate a permission issue or Fusion internal error. "
+            f"Please ask the user to check Fusion's file access permissions and try again. Expected file: {filepath}",
+        ) from e
+    finally:
+        # 前回の画像を誤って返さないように、読み込んだら削除する
+        filepath.unlink(missing_ok=True)
+
+    return {"png_base64": base64.b64encode(image_bytes).decode("ascii")}
+
+
+def get_viewport_screenshot_inline_from_params(_params: dict[str, Any]) -> dict[str, str]:
+    """リクエストのパラメータ辞書からget_viewport_screenshot_inlineを呼び出す"""
+    return get_viewport_screenshot_inline()
@@ -1,14 +1,167 @@
+import contextlib
 import json
 import socket
 import threading
-from http.server import BaseHTTPRequestHandler, HTTPServer
+from collections.abc import Callable
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from ipaddress import ip_address
-from typing import Any
+from typing import Any, cast
 
 from ...lib import fusionAddInUtils as futil
 from .errors import FusionExecutionError, FusionServerError, InvalidUserInputError
 from .handlers import execute_code, health, parameters, screenshot
 
+KEEPALIVE_TIMEOUT = 60.0
+"""キープアライブ中の接続を待ち続ける最大時間(秒)
+
+これを超えて次のリクエストが来なければ接続を閉じ、接続ごとのスレッドを終了させる。
+"""
+
+BATCH_ACTION = "batch"
+"""複数のアクションをまとめて実行するアクションの名前"""
+
+_JSON_ENCODE = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+
+def _encode_json_body(data: object) -> bytes:
+    """レスポンスの本文をUTF-8のJSONにエンコードする
+
+    非ASCII文字はエスケープせずにそのまま書き出し、本文のサイズを抑える。
+    単独のサロゲートだけはUnicodeエスケープに戻し、有効なJSONのまま送る。
+    """
+    return _JSON_ENCODE(data).encode("utf-8", "backslashreplace")
+
+
+# 内容が固定のレスポンスは起動時に一度だけエンコードしておく
+_FORBIDDEN_BODY = _encode_json_body(
+    {
+        "success": False,
+        "error": {
+            "type": "Forbidden",
+            "message": "Only local loopback requests are allowed.",
+        },
+    },
+)
+
+_BAD_JSON_BODY = _encode_json_body(
+    {
+        "success": False,
+        "error": {"type": "BadRequest", "message": "Invalid JSON format."},
+    },
+)
+
+_UNAVAILABLE_BODY = _encode_json_body(
+    {
+        "success": False,
+        "error": {
+            "type": "ServiceUnavailable",
+            "message": "Fusion add-in server is stopping. Ask the user to restart 'mcp-addin'.",
+        },
+    },
+)
+
+
+class _ConnectionTrackingHTTPServer(ThreadingHTTPServer):
+    """受け付けた接続を記録し、停止時にまとめて切断できるHTTPサーバー
+
+    キープアライブ中の接続はリスナーを閉じても残り、接続ごとのスレッドが応答し続ける。
+    停止後にアクションが実行されないように、`close_connections`で切断する。
+    """
+
+    def __init__(
+        self,
+        server_address: tuple[str, int],
+        handler_class: type[BaseHTTPRequestHandler],
+    ) -> None:
+        self._connections: set[socket.socket] = set()
+        self._connections_lock = threading.Lock()
+        super().__init__(server_address, handler_class)
+
+    def process_request(
+        self,
+        request: socket.socket | tuple[bytes, socket.socket],
+        client_address: Any,  # noqa: ANN401
+    ) -> None:
+        # TCPのサーバーなので、requestは常に接続ごとのソケット
+        if isinstance(request, socket.socket):
+            with self._connections_lock:
+                self._connections.add(request)
+        super().process_request(request, client_address)
+
+    def shutdown_request(self, request: socket.socket | tuple[bytes, socket.socket]) -> None:
+        if isinstance(request, socket.socket):
+            with self._connections_lock:
+                self._connections.discard(request)
+        super().shutdown_request(request)
+
+    def close_connections(self) -> None:
+        """開いている接続をすべて切断する
+
+        接続ごとのスレッドは読み書きに失敗して終了し、ソケットはそのスレッドが閉じる。
+        """
+        with self._connections_lock:
+            connections = list(self._connections)
+        for connection in connections:
+            with contextlib.suppress(OSError):
+                connection.shutdown(socket.SHUT_RDWR)
+
+
+class _JSONRequestHandler(BaseHTTPRequestHandler):
+    """JSONのリクエストとレスポンスを扱うハンドラーの共通部分"""
+
+    # キープアライブで同じ接続を複数のリクエストに使い回す
+    protocol_version = "HTTP/1.1"
+    # アイドル状態の接続がスレッドを占有し続けないようにする
+    timeout = KEEPALIVE_TIMEOUT
+
+    def _read_params(self) -> dict[str, Any]:
+        """リクエストボディを読み込み、パラメータの辞書として返す
+
+        本文を最後まで読めなかった場合は、残りのバイト列が次のリクエストとして
+        解釈されないように、レスポンスを返したあとで接続を閉じる。
+
+        Raises:
+            InvalidUserInputError: Content-Lengthが不正な場合や、本文がJSONオブジェクトでない場合
+            json.JSONDecodeError: 本文が不正なJSONの場合
+
+        """
+        try:
+            content_length = int(self.headers.get("Content-Length") or 0)
+        except ValueError as e:
+            self.close_connection = True
+            raise InvalidUserInputError("Invalid Content-Length header.") from e
+        if content_length < 0:
+            self.close_connection = True
+            raise InvalidUserInputError("Invalid Content-Length header.")
+
+        # 本文がなければ読み込みとデコードを省略し、json.loadsにはbytesのまま渡す
+        if not content_length:
+            return {}
+        try:
+            body = self.rfile.read(content_length)
+        except OSError:
+            self.close_connection = True
+            raise
+
+        params = json.loads(body)
+        if not isinstance(params, dict):
+            raise InvalidUserInputError("Request body must be a JSON object.")
+        return params
+
+    def _send_body(self, status_code: int, body: bytes) -> None:
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        # send_headerはConnectionヘッダーの値でclose_connectionを上書きするので、
+        # 接続を閉じる場合(クライアントの指定を含む)はcloseを送る
+        self.send_header("Connection", "close" if self.close_connection else "keep-alive")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:  # noqa: A002, ANN401
+        # HTTPサーバーのログメッセージを無効化
+        pass
+
 
 class FusionServer:
     """FusionアドインでMCPサーバーからのリクエストを受け付けるサーバー"""
@@ -24,55 +177,68 @@ class FusionServer:
 
         self.is_running = False
 
-        self.http_servers: list[HTTPServer] = []
+        self.http_servers: list[_ConnectionTrackingHTTPServer] = []
         self.server_threads: list[threading.Thread] = []
 
-        self.actions = {
-            "health": health.health,
-            "execute_code": execute_code.execute_code_in_transaction,
-            "get_viewport_screenshot": screenshot.get_viewport_screenshot,
+        # 接続ごとにスレッドが作られるため、Fusion APIを呼び出すアクションは1つずつ実行する
+        self._action_lock = threading.Lock()
+
+        # 各アクションはリクエストのパラメータ辞書をそのまま受け取る
+        self.actions: dict[str, Callable[[dict[str, Any]], object]] = {
+            "health": health.health_from_params,
+            "execute_code": execute_code.execute_code_in_transaction_from_params,
+            "get_viewport_screenshot": screenshot.get_viewport_screenshot_from_params,
+            "get_viewport_screenshot_inline": screenshot.get_viewport_screenshot_inline_from_params,
             # parameters
-            "get_user_parameters": parameters.get_user_parameters,
-            "set_parameter": parameters.set_parameter,
+            "get_user_parameters": parameters.get_user_parameters_from_params,
+            "set_parameter": parameters.set_parameter_from_params,
+            "set_parameters": parameters.set_parameters_batch_from_params,
+        }
+
+        # アクション名からエラー変換済みのハンドラーを引く辞書
+        self._dispatch: dict[str, Callable[[dict[str, Any]], object]] = {
+            name: self._wrap_handler(handler_method)
+            for name, handler_method in self.actions.items()
         }
+        # バッチ内の各アクションがロックを取得するので、バッチ自体はラップしない
+        self._dispatch[BATCH_ACTION] = self._dispatch_batch
 
     def _create_handler_class(self) -> type[BaseHTTPRequestHandler]:
         """Create an HTTP handler bound to this server instance."""
         # self(FusionServerインスタンス)をハンドラーから参照できるようにする
         server_instance = self
 
-        class CustomHandler(BaseHTTPRequestHandler):
+        class CustomHandler(_JSONRequestHandler):
             def do_POST(self) -> None:
+                if not server_instance.is_running:
+                    # 停止後に残った接続ではアクションを実行せず、接続を閉じる
+                    self.close_connection = True
+                    self._send_body(503, _UNAVAILABLE_BODY)
+                    return
+
                 client_ip = self.client_address[0]
                 if not is_loopback_address(client_ip):
                     futil.log(f"Rejected non-local request from {client_ip}")
-                    self._send_json_response(
-                        403,
-                        {
-                            "success": False,
-                            "error": {
-                                "type": "Forbidden",
-                                "message": "Only local loopback requests are allowed.",
-                            },
-                        },
-                    )
+                    # 本文を読まずに返すので、接続は再利用せずに閉じる
+                    self.close_connection = True
+                    self._send_body(403, _FORBIDDEN_BODY)
                     return
 
-                response_data: dict[str, Any] = {}
-                status_code = 500
+                response_data: dict[str, Any]
+                status_code: int
 
                 try:
                     # URLパスからアクション名を取得
                     action_name = self.path.strip("/")
 
-                    # リクエストボディを読み込む
-                    content_length = int(self.headers.get("Content-Length", 0))
-                    post_data = self.rfile.read(content_length).decode("utf-8")
-                    params = json.loads(post_data) if post_data else {}
+                    params = self._read_params()
 
                     # アクションを実行
                     # FusionServerErrorが発生する可能性がある
-                    result = server_instance._execute_handler(action_name, **params)
+                    handler = server_instance._dispatch.get(action_name)
+                    if handler is None:
+                        raise InvalidUserInputError(f"Action '{action_name}' not found.")  # noqa: TRY301
+                    result = handler(params)
 
                     response_data = {
                         "success": True,
@@ -95,12 +261,10 @@ class FusionServer:
                     status_code = 200
 
                 except json.JSONDecodeError as e:
+                    # 詳細はログにのみ出力し、レスポンスには固定の本文を返す
                     futil.handle_error(f"Invalid JSON in request: {e}")
-                    response_data = {
-                        "success": False,
-                        "error": {"type": "BadRequest", "message": f"Invalid JSON format: {e}"},
-                    }
-                    status_code = 400
+                    self._send_body(400, _BAD_JSON_BODY)
+                    return
 
                 except Exception as e:
                     futil.handle_error(f"Unexpected error processing request: {e}")
@@ -113,18 +277,7 @@ class FusionServer:
                     }
                     status_code = 500
 
-                finally:
-                    self._send_json_response(status_code, response_data)
-
-            def _send_json_response(self, status_code: int, response_data: dict[str, Any]) -> None:
-                self.send_response(status_code)
-                self.send_header("Content-Type", "application/json")
-                self.end_headers()
-                self.wfile.write(json.dumps(response_data).encode("utf-8"))
-
-            def log_message(self, format: str, *args: Any) -> None:  # noqa: A002, ANN401
-                # HTTPサーバーのログメッセージを無効化
-                pass
+                self._send_body(status_code, _encode_json_body(response_data))
 
         return CustomHandler
 
@@ -169,16 +322,19 @@ class FusionServer:
         """Stop all active HTTP listeners and background server threads."""
         if self.http_servers:
             futil.log("Stopping FusionServer...")
+            # 切断が間に合わなかった接続にも、以降のリクエストを拒否させる
+            self.is_running = False
 
             for http_server, thread in zip(self.http_servers, self.server_threads, strict=False):
                 if thread.is_alive():
                     http_server.shutdown()
                 http_server.server_close()
+                # リスナーを閉じても、キープアライブ中の接続は残るので切断する
+                http_server.close_connections()
 
             for thread in self.server_threads:
                 thread.join(timeout=1)
 
-            self.is_running = False
             self.http_servers = []
             self.server_threads = []
 
@@ -191,56 +347,115 @@ class FusionServer:
         self,
         host: str,
         handler: type[BaseHTTPRequestHandler],
-    ) -> HTTPServer:
+    ) -> _ConnectionTrackingHTTPServer:
+        # ThreadingHTTPServerはdaemon_threadsが有効なので、接続中のスレッドが停止を妨げない
         if ":" in host:
 
-            class IPv6HTTPServer(HTTPServer):
+            class IPv6HTTPServer(_ConnectionTrackingHTTPServer):
                 address_family = socket.AF_INET6
 
             return IPv6HTTPServer((host, self.port), handler)
 
-        return HTTPServer((host, self.port), handler)
+        return _ConnectionTrackingHTTPServer((host, self.port), handler)
 
     def _ensure_server_thread_started(self, thread: threading.Thread) -> None:
         if not thread.is_alive():
             raise RuntimeError("FusionServer listener thread failed to start.")
 
-    def _execute_handler(self, action_name: str, **params: object) -> object:
-        """指定されたアクションのハンドラーを実行する
+    def _wrap_handler(
+        self,
+        handler_method: Callable[[dict[str, Any]], object],
+    ) -> Callable[[dict[str, Any]], object]:
+        """アクションのハンドラーをエラー変換付きの関数にする
 
-        CustomHandlerインスタンスから呼び出される。
-        CustomHandlerはselfの中で作成されるため、プライベートメソッドとして定義。
+        サーバーの初期化時に一度だけ呼び出し、リクエストごとの処理を辞書の検索と呼び出しだけにする。
 
         Args:
-            action_name (str): 実行するアクションの名前
-            **params: アクションに渡すパラメータ
+            handler_method (Callable[[dict[str, Any]], object]): アクションのハンドラー
 
         Returns:
-            object: アクションの実行結果
+            Callable[[dict[str, Any]], object]:
+                予期しないエラーをFusionExecutionErrorに変換して実行する関数
 
-        Raises:
-            FusionServerError: アクションの実行中にエラーが発生した場合
+        """
+        action_lock = self._action_lock
+
+        def dispatch(params: dict[str, Any]) -> object:
+            try:
+                with action_lock:
+                    return handler_method(params)
+            except FusionServerError:
+                # このサーバー用に定義されたエラー
+                # そのまま返す
+                raise
+            except Exception as e:
+                raise FusionExecutionError(
+                    f"An error occurred during execution in Fusion 360: {e}",
+                ) from e
+
+        return dispatch
+
+    def _dispatch_batch(self, params: dict[str, Any]) -> list[dict[str, Any]]:
+        """複数のアクションを順に実行し、それぞれの結果をまとめて返す
 
+        MCPサーバーが短い間隔で発行した呼び出しを1回のリクエストで処理するために使う。
+        各アクションの成否は、単体で呼び出したときと同じ形式のレスポンスとして返す。
+
+        Args:
+            params (dict[str, Any]): `action`と`params`を持つ辞書のリスト`items`を含む辞書
+
+        Returns:
+            list[dict[str, Any]]: 各アクションのレスポンス（`items`と同じ順序）
+
+        Raises:
+            InvalidUserInputError: `items`がリストでない場合
 
         """
-        if action_name not in self.actions:
-            raise InvalidUserInputError(f"Action '{action_name}' not found.")
+        items = params.get("items")
+        if not isinstance(items, list):
+            raise InvalidUserInputError("Parameter 'items' must be a list")
 
-        try:
-            handler_method = self.actions[action_name]
-            result = handler_method(**params)
+        responses: list[dict[str, Any]] = []
+        for item in items:
+            try:
+                result = self._dispatch_batch_item(item)
+            except FusionServerError as e:
+                futil.handle_error(f"Batch action failed: [{e.error_type}] {e}")
+                responses.append(
+                    {
+                        "success": False,
+                        "error": {
+                            "type": e.error_type,
+                            "message": str(e),
+                        },
+                    },
+                )
+            else:
+                responses.append({"success": True, "result": result})
+
+        return responses
+
+    def _dispatch_batch_item(self, item: object) -> object:
+        """バッチ内の1つのアクションを実行する"""
+        if not isinstance(item, dict):
+            raise InvalidUserInputError("Each batch item must be a JSON object.")
+        # JSONオブジェクトのキーは常に文字列
+        batch_item = cast("dict[str, Any]", item)
+
+        action_name = batch_item.get("action")
+        handler = (
+            self._dispatch.get(action_name)
+            if isinstance(action_name, str) and action_name != BATCH_ACTION
+            else None
+        )
+        if handler is None:
+            raise InvalidUserInputError(f"Action '{action_name}' not found.")
 
-        except FusionServerError:
-            # このサーバー用に定義されたエラー
-            # そのまま返す
-            raise
-        except Exception as e:
-            raise FusionExecutionError(
-                f"An error occurred during execution in Fusion 360: {e}",
-            ) from e
+        params = batch_item.get("params") or {}
+        if not isinstance(params, dict):
+            raise InvalidUserInputError("Batch item 'params' must be a JSON object.")
 
-        else:
-            return result
+        return handler(params)
 
 
 def is_loopback_address(address: str) -> bool:
@@ -1,19 +1,45 @@
+import asyncio
+import atexit
+import contextlib
+import json
 import logging
-from dataclasses import dataclass
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from typing import Any
 
 import httpx
+from pydantic import BaseModel, ConfigDict, ValidationError
 
 # ログ設定
-logging.basicConfig(level=logging.INFO)
+# 標準エラー出力への書き込みはバックグラウンドのスレッドでおこない、
+# ログの出力でイベントループを止めないようにする
+_log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+_stderr_handler = logging.StreamHandler()
+_stderr_handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+_log_listener = QueueListener(_log_queue, _stderr_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
 logger = logging.getLogger("Fusion MCP Server")
+logger.setLevel(logging.INFO)
+logger.addHandler(QueueHandler(_log_queue))
+logger.propagate = False
 
 # 定数
 DEFAULT_HOST = "127.0.0.1"
 DEFAULT_PORT = 3600
 DEFAULT_TIMEOUT = 10.0
+MAX_CONNECTIONS = 16
+MAX_KEEPALIVE_CONNECTIONS = 4
+# アドイン側はアイドル状態の接続を60秒で閉じるため、それより先にクライアント側で手放す
+KEEPALIVE_EXPIRY = 30.0
 HTTP_STATUS_FORBIDDEN = 403
 
+BATCH_ACTION = "batch"
+BATCH_SIZE = 8
+BATCH_WINDOW = 100e-6
+"""最初の呼び出しから、同じバッチに含める呼び出しを待つ時間(秒)"""
+
 ADDIN_CONNECTION_ERROR = {
     "type": "FusionServerConnectionError",
     "message": "Cannot connect to 'mcp-addin', Fusion Add-in. Instruct the user to run 'mcp-addin'.",
@@ -39,6 +65,63 @@ ACCESS_DENIED_ERROR = {
     "message": "Fusion add-in rejected a non-local request. Ensure mcp-server runs on the same machine as Fusion.",
 }
 
+CLIENT_CLOSED_ERROR = {
+    "type": "FusionClientClosedError",
+    "message": "The MCP server is shutting down and did not receive the result. The action may or may not have run in Fusion.",
+}
+
+
+class FusionError(BaseModel):
+    """アドインから返されるエラー情報"""
+
+    model_config = ConfigDict(frozen=True)
+
+    type: str = UNKNOWN_ERROR["type"]
+    message: str = UNKNOWN_ERROR["message"]
+
+
+class FusionResponse(BaseModel):
+    """アドインから返されるレスポンス
+
+    `result`の形式はアクションごとに異なるため、呼び出し側で検証する。
+    """
+
+    model_config = ConfigDict(frozen=True)
+
+    success: bool = False
+    result: Any = None
+    error: FusionError | None = None
+
+
+def _parse_response(content: bytes) -> FusionResponse:
+    """レスポンスの本文をデコードし、エンベロープのモデルとして検証する
+
+    アドインは単独のサロゲートをUnicodeエスケープで送るが、pydanticのJSONパーサーは
+    これを受け付けないため、デコードは標準ライブラリのjsonでおこなう。
+
+    Raises:
+        ValueError: 本文が不正なJSONの場合や、エンベロープの形式が誤っている場合。
+            JSONDecodeError、UnicodeDecodeError、ValidationErrorはいずれもValueErrorのサブクラス。
+
+    """
+    return FusionResponse.model_validate(json.loads(content))
+
+
+# 内容が固定のエラーレスポンス
+# レスポンスは変更できないので、同じインスタンスを返す
+ADDIN_CONNECTION_ERROR_RESPONSE = FusionResponse(error=FusionError(**ADDIN_CONNECTION_ERROR))
+ADDIN_TIMEOUT_ERROR_RESPONSE = FusionResponse(error=FusionError(**ADDIN_TIMEOUT_ERROR))
+RESPONSE_PARSE_ERROR_RESPONSE = FusionResponse(error=FusionError(**RESPONSE_PARSE_ERROR))
+ACCESS_DENIED_ERROR_RESPONSE = FusionResponse(error=FusionError(**ACCESS_DENIED_ERROR))
+CLIENT_CLOSED_ERROR_RESPONSE = FusionResponse(error=FusionError(**CLIENT_CLOSED_ERROR))
+
+# アドインに接続できない場合のヘルスチェック結果
+ADDIN_UNREACHABLE_HEALTH = {
+    "connected": False,
+    "service": "mcp-addin",
+    "message": "Fusion add-in is not reachable. Ask the user to start 'mcp-addin' in Fusion.",
+}
+
 
 class FusionHealthCheckError(Exception):
     """Raised when a health check cannot determine connectivity."""
@@ -62,17 +145,54 @@ def format_error(
     return f"{error_type}: {message}"
 
 
-@dataclass
 class FusionAddinClient:
-    """Fusionアドインのサーバーと接続するクライアント"""
+    """Fusionアドインのサーバーと接続するクライアント
 
-    host: str = DEFAULT_HOST
-    port: int = DEFAULT_PORT
+    接続はキープアライブで使い回すため、不要になったら`aclose`を呼び出す。
+    """
 
-    @property
-    def base_url(self) -> str:
-        """サーバーのベースURL"""
-        return f"http://{self.host}:{self.port}"
+    __slots__ = ("_client", "_urls", "base_url", "host", "port")
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        self.host = host
+        self.port = port
+        # ホストとポートは変わらないので、ベースURLは一度だけ組み立てる
+        self.base_url = f"http://{host}:{port}"
+        self._client: httpx.AsyncClient | None = None
+        self._urls: dict[str, httpx.URL] = {}
+
+    def _action_url(self, action_name: str) -> httpx.URL:
+        """アクションのURLを取得する
+
+        アクションの種類は少ないので、パース済みのURLをアクションごとにキャッシュする。
+        """
+        url = self._urls.get(action_name)
+        if url is None:
+            url = self._urls[action_name] = httpx.URL(f"{self.base_url}/{action_name}")
+        return url
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        """共有のHTTPクライアントを取得する
+
+        初回呼び出し時に作成し、以降は同じ接続プールを再利用する。
+        """
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=DEFAULT_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=MAX_CONNECTIONS,
+                    max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+                    keepalive_expiry=KEEPALIVE_EXPIRY,
+                ),
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        """共有のHTTPクライアントを閉じ、接続プールを解放する"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
 
     async def check_health(self) -> dict[str, Any]:
         """Fusion add-in への接続状態を確認する.
@@ -84,38 +204,33 @@ class FusionAddinClient:
             FusionHealthCheckError: 接続状態を判定できない場合
 
         """
-        url = f"{self.base_url}/health"
-        logger.info(f"Checking Fusion add-in health at {url}")
+        url = self._action_url("health")
+        logger.info("Checking Fusion add-in health at %s", url)
 
         try:
-            async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT) as client:
-                response = await client.post(url, json={})
+            client = await self._get_client()
+            response = await client.post(url, json={})
         except httpx.ConnectError:
-            logger.info(f"Fusion add-in is not reachable at {url}")
-            return {
-                "connected": False,
-                "service": "mcp-addin",
-                "message": (
-                    "Fusion add-in is not reachable. Ask the user to start 'mcp-addin' in Fusion."
-                ),
-            }
+            logger.info("Fusion add-in is not reachable at %s", url)
+            # 呼び出し元が変更しても共有の辞書に影響しないよう、コピーを返す
+            return dict(ADDIN_UNREACHABLE_HEALTH)
         except httpx.TimeoutException as e:
-            logger.exception(f"Health check to {url} timed out.")
+            logger.exception("Health check to %s timed out.", url)
             raise FusionHealthCheckError(
                 ADDIN_TIMEOUT_ERROR["type"],
                 ADDIN_TIMEOUT_ERROR["message"],
             ) from e
         except httpx.RequestError as e:
-            logger.exception(f"Health check request failed: {e!s}")
+            logger.exception("Health check request failed: %s", e)
             raise FusionHealthCheckError(
                 "FusionServerRequestError",
                 f"Network error while communicating with Fusion Add-in: {e!s}.",
             ) from e
 
         try:
-            response_data = response.json()
-        except Exception as e:
-            logger.exception(f"Failed to decode JSON response from {url}: {response.text}")
+            response_data = _parse_response(response.content)
+        except ValueError as e:
+            logger.exception("Failed to decode JSON response from %s: %s", url, response.text)
             raise FusionHealthCheckError(
                 RESPONSE_PARSE_ERROR["type"],
                 RESPONSE_PARSE_ERROR["message"],
@@ -137,25 +252,27 @@ class FusionAddinClient:
                 f"Health check returned unexpected HTTP status {response.status_code}.",
             )
 
-        if not response_data.get("success", False):
-            error_info = response_data.get("error", {})
-            raise FusionHealthCheckError(
-                error_info.get("type", "FusionHealthCheckError"),
-                error_info.get("message", "Fusion add-in health check did not return success."),
-            )
+        if not response_data.success:
+            error_info = response_data.error
+            if error_info is None:
+                raise FusionHealthCheckError(
+                    "FusionHealthCheckError",
+                    "Fusion add-in health check did not return success.",
+                )
+            raise FusionHealthCheckError(error_info.type, error_info.message)
 
-        result = response_data.get("result", {})
+        result = response_data.result if isinstance(response_data.result, dict) else {}
         return {
             "connected": True,
             "service": result.get("service", "mcp-addin"),
             "message": "Fusion add-in is reachable.",
         }
 
-    async def call_action(  # noqa: PLR0911
+    async def call_action(
         self,
         action_name: str,
         params: dict[str, Any] | None = None,
-    ) -> dict[str, Any]:
+    ) -> FusionResponse:
         """アドインサーバーのアクションを呼び出す
 
         Args:
@@ -163,109 +280,247 @@ class FusionAddinClient:
             params (dict, optional): アクションのパラメータ
 
         Returns:
-            dict: アクションの実行結果
+            FusionResponse: アクションの実行結果
 
         """
-        url = f"{self.base_url}/{action_name}"
-        params = params or {}
+        return await self._post(action_name, params or {}, DEFAULT_TIMEOUT)
 
-        logger.info(f"Calling action '{action_name}' at {url}")
+    async def _post(  # noqa: PLR0911
+        self,
+        action_name: str,
+        params: dict[str, Any],
+        request_timeout: float,
+    ) -> FusionResponse:
+        """アクションのリクエストを送信し、レスポンスを検証して返す
 
-        try:
-            async with httpx.AsyncClient(timeout=DEFAULT_TIMEOUT) as client:
-                response = await client.post(url, json=params)
+        Args:
+            action_name (str): 呼び出すアクション名
+            params (dict): アクションのパラメータ
+            request_timeout (float): レスポンスを待つ時間(秒)
 
-            # JSONレスポンスをデコード
-            try:
-                response_data = response.json()
-            except Exception:
-                logger.exception(f"Failed to decode JSON response from {url}: {response.text}")
-                return self._create_error_response(
-                    RESPONSE_PARSE_ERROR["type"],
-                    RESPONSE_PARSE_ERROR["message"],
-                )
+        Returns:
+            FusionResponse: アクションの実行結果
 
-            # レスポンス処理
-            if response.is_success:
-                return self._handle_ok_response(response_data, action_name)
+        """
+        url = self._action_url(action_name)
 
-            return self._handle_error_response(response_data, response.status_code, action_name)
+        logger.info("Calling action '%s' at %s", action_name, url)
 
+        # 想定外の例外は呼び出し元（MCPツールのエラーハンドラ）に任せる
+        try:
+            client = await self._get_client()
+            response = await client.post(url, json=params, timeout=request_timeout)
         except httpx.ConnectError:
-            logger.exception(f"Connection to {url} failed. Is the server running?")
-            return self._create_error_response(
-                ADDIN_CONNECTION_ERROR["type"],
-                ADDIN_CONNECTION_ERROR["message"],
-            )
-
+            logger.exception("Connection to %s failed. Is the server running?", url)
+            return ADDIN_CONNECTION_ERROR_RESPONSE
         except httpx.TimeoutException:
-            logger.exception(f"Request to {url} timed out.")
-            return self._create_error_response(
-                ADDIN_TIMEOUT_ERROR["type"],
-                ADDIN_TIMEOUT_ERROR["message"],
-            )
-
+            logger.exception("Request to %s timed out.", url)
+            return ADDIN_TIMEOUT_ERROR_RESPONSE
         except httpx.RequestError as e:
-            logger.exception(f"Request failed: {e!s}")
+            logger.exception("Request failed: %s", e)
             return self._create_error_response(
                 "FusionServerRequestError",
                 f"Network error while communicating with Fusion Add-in: {e!s}. Please ask the user to check their network connection and ensure Fusion is accessible.",
             )
 
-        except Exception as e:
-            logger.exception(f"Unexpected error while calling action '{action_name}': {e!s}")
-            return self._create_error_response(
-                UNKNOWN_ERROR["type"],
-                f"{UNKNOWN_ERROR['message']} Details: {e!s}",
-            )
+        try:
+            response_data = _parse_response(response.content)
+        except ValueError:
+            logger.exception("Failed to decode JSON response from %s: %s", url, response.text)
+            return RESPONSE_PARSE_ERROR_RESPONSE
+
+        # レスポンス処理
+        # ほとんどの呼び出しは成功するので、先に判定してそのまま返す
+        is_http_success = response.is_success
+        if is_http_success and response_data.success:
+            return response_data
+
+        # 以降は失敗した場合のみ
+        if not is_http_success:
+            return self._handle_error_response(response_data, response.status_code, action_name)
+
+        return self._handle_ok_response(response_data, action_name)
 
     def _handle_ok_response(
         self,
-        response_data: dict[str, Any],
+        response_data: FusionResponse,
         action_name: str,
-    ) -> dict[str, Any]:
+    ) -> FusionResponse:
         """HTTPステータスが正常な場合のレスポンス処理"""
-        is_success = response_data.get("success", False)
-
-        if is_success:
+        if response_data.success:
             return response_data
 
         # サーバーからの論理エラー
-        logger.error(f"Action '{action_name}' failed with error: {response_data.get('error', {})}")
+        logger.error("Action '%s' failed with error: %s", action_name, response_data.error)
 
-        error_info = response_data.get("error", {})
-        return self._create_error_response(
-            error_info.get("type", "FusionServerError"),
-            error_info.get("message", "An unknown error occurred"),
-        )
+        if response_data.error is None:
+            return self._create_error_response("FusionServerError", "An unknown error occurred")
+        return FusionResponse(error=response_data.error)
 
     def _handle_error_response(
         self,
-        response_data: dict[str, Any],
+        response_data: FusionResponse,
         status_code: int,
         action_name: str,
-    ) -> dict[str, Any]:
+    ) -> FusionResponse:
         """HTTPエラーステータスの場合のレスポンス処理"""
         logger.error(
-            f"Action '{action_name}' failed with HTTP status {status_code}: {response_data}",
+            "Action '%s' failed with HTTP status %s: %s",
+            action_name,
+            status_code,
+            response_data,
         )
         if status_code == HTTP_STATUS_FORBIDDEN:
+            return ACCESS_DENIED_ERROR_RESPONSE
+        if response_data.error is None:
             return self._create_error_response(
-                ACCESS_DENIED_ERROR["type"],
-                ACCESS_DENIED_ERROR["message"],
+                "ServerError", f"Server returned status {status_code}"
             )
-        error_info = response_data.get("error", {})
-        return self._create_error_response(
-            error_info.get("type", "ServerError"),
-            error_info.get("message", f"Server returned status {status_code}"),
-        )
+        return FusionResponse(error=response_data.error)
 
-    def _create_error_response(self, error_type: str, message: str) -> dict[str, Any]:
+    def _create_error_response(self, error_type: str, message: str) -> FusionResponse:
         """エラーレスポンスを作成する"""
-        return {
-            "success": False,
-            "error": {
-                "type": error_type,
-                "message": message,
-            },
-        }
+        return FusionResponse(error=FusionError(type=error_type, message=message))
+
+
+class BatchingFusionClient(FusionAddinClient):
+    """短い間隔で発行されたアクションの呼び出しを1回のリクエストにまとめるクライアント
+
+    呼び出しはキューに積まれ、バックグラウンドのタスクが`BATCH_WINDOW`の間に集まった
+    呼び出しを最大`BATCH_SIZE`件まで`batch`アクションで送信する。
+    1件だけのときは通常のリクエストとして送信する。
+
+    バッチのリクエスト自体がタイムアウトや接続エラーで失敗した場合は、
+    バッチ内のすべての呼び出しに同じエラーを返す。
+    アドイン側ですでに実行されたアクションがあっても区別できないため、
+    `execute_code`などはエラーになってもモデルが変更されている可能性がある。
+    """
+
+    __slots__ = ("_queue", "_worker")
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        super().__init__(host, port)
+        self._queue: asyncio.Queue[tuple[str, dict[str, Any], asyncio.Future[FusionResponse]]] = (
+            asyncio.Queue()
+        )
+        self._worker: asyncio.Task[None] | None = None
+
+    async def call_action(
+        self,
+        action_name: str,
+        params: dict[str, Any] | None = None,
+    ) -> FusionResponse:
+        """アクションの呼び出しをキューに積み、結果を待つ
+
+        タイムアウトはバッチの件数に応じて決まる。
+        """
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run_batches())
+
+        future: asyncio.Future[FusionResponse] = asyncio.get_running_loop().create_future()
+        await self._queue.put((action_name, params or {}, future))
+        return await future
+
+    async def aclose(self) -> None:
+        """バックグラウンドのタスクを止め、接続プールを解放する
+
+        結果を待っている呼び出しには、`CLIENT_CLOSED_ERROR`のレスポンスを返す。
+        """
+        if self._worker is not None:
+            self._worker.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._worker
+            self._worker = None
+
+        # まだ送信されていない呼び出しも、待たせたままにしない
+        pending: list[tuple[str, dict[str, Any], asyncio.Future[FusionResponse]]] = []
+        while not self._queue.empty():
+            pending.append(self._queue.get_nowait())
+        _set_results(pending, [CLIENT_CLOSED_ERROR_RESPONSE] * len(pending))
+
+        await super().aclose()
+
+    async def _run_batches(self) -> None:
+        """キューに積まれた呼び出しをまとめて送信し続ける"""
+        while True:
+            items = [await self._queue.get()]
+
+            try:
+                # 続けて発行される呼び出しを少しだけ待ってから、まとめて取り出す
+                await asyncio.sleep(BATCH_WINDOW)
+                while len(items) < BATCH_SIZE and not self._queue.empty():
+                    items.append(self._queue.get_nowait())
+
+                responses = await self._send_batch(items)
+            except asyncio.CancelledError:
+                # クライアントを閉じるときは、取り出した呼び出しにも結果を返してから止まる
+                _set_results(items, [CLIENT_CLOSED_ERROR_RESPONSE] * len(items))
+                raise
+            except Exception as e:
+                logger.exception("Unexpected error while sending a batch of actions")
+                responses = [
+                    self._create_error_response(
+                        UNKNOWN_ERROR["type"],
+                        f"{UNKNOWN_ERROR['message']} Details: {e!s}",
+                    ),
+                ] * len(items)
+
+            _set_results(items, responses)
+
+    async def _send_batch(
+        self,
+        items: list[tuple[str, dict[str, Any], asyncio.Future[FusionResponse]]],
+    ) -> list[FusionResponse]:
+        """呼び出しをアドインに送信し、呼び出しごとのレスポンスを返す"""
+        if len(items) == 1:
+            action_name, params, _ = items[0]
+            return [await self._post(action_name, params, DEFAULT_TIMEOUT)]
+
+        # アドインはバッチ内のアクションを順に実行するので、件数分の時間を待つ
+        batch_response = await self._post(
+            BATCH_ACTION,
+            {"items": [{"action": name, "params": params} for name, params, _ in items]},
+            DEFAULT_TIMEOUT * len(items),
+        )
+        if not batch_response.success:
+            # 通信エラーなどはバッチ内のすべての呼び出しに同じエラーを返す
+            # タイムアウトの場合、アドイン側では一部のアクションがすでに実行済みのことがある
+            # どれが実行されたかはわからないので、呼び出し元には失敗として伝える
+            logger.error(
+                "Batch of %d actions failed; some may have already run in Fusion: %s",
+                len(items),
+                [name for name, _, _ in items],
+            )
+            return [batch_response] * len(items)
+
+        results = batch_response.result
+        if not isinstance(results, list) or len(results) != len(items):
+            logger.error("Batch response does not match the request: %s", results)
+            return [RESPONSE_PARSE_ERROR_RESPONSE] * len(items)
+
+        # 検証は項目ごとにおこない、不正な項目があってもほかの呼び出しの結果は返す
+        return [
+            self._parse_batch_item(result, action_name)
+            for (action_name, _, _), result in zip(items, results, strict=True)
+        ]
+
+    def _parse_batch_item(self, result: object, action_name: str) -> FusionResponse:
+        """バッチのレスポンスに含まれる1件分の結果を検証する"""
+        try:
+            item_response = FusionResponse.model_validate(result)
+        except ValidationError:
+            logger.exception("Invalid response for batched action '%s': %s", action_name, result)
+            return RESPONSE_PARSE_ERROR_RESPONSE
+
+        return self._handle_ok_response(item_response, action_name)
+
+
+def _set_results(
+    items: list[tuple[str, dict[str, Any], asyncio.Future[FusionResponse]]],
+    responses: list[FusionResponse],
+) -> None:
+    """呼び出しごとのレスポンスを、結果を待っている呼び出し元に渡す"""
+    for (_, _, future), response in zip(items, responses, strict=True):
+        # 呼び出し元がキャンセルした場合は結果を捨てる
+        if not future.done():
+            future.set_result(response)
@@ -1,13 +1,12 @@
-import os
-import tempfile
-from collections.abc import Callable
+import base64
+import binascii
+from collections.abc import AsyncIterator, Callable
+from contextlib import asynccontextmanager
 from functools import cache, wraps
-from pathlib import Path
 from typing import Annotated
 
-import anyio
 import httpx
-from fastmcp import Context, FastMCP
+from fastmcp import FastMCP
 from fastmcp.exceptions import ToolError
 from fastmcp.utilities.types import Image
 from fusion_client import (
@@ -15,17 +14,32 @@ from fusion_client import (
     ADDIN_TIMEOUT_ERROR,
     RESPONSE_PARSE_ERROR,
     UNKNOWN_ERROR,
+    BatchingFusionClient,
     FusionAddinClient,
+    FusionError,
     FusionHealthCheckError,
     format_error,
+    logger,
 )
 from pydantic import BaseModel, Field, ValidationError
 
 
 @cache
 def get_fusion_addin_client() -> FusionAddinClient:
-    """FusionAddinClientのシングルトンインスタンスを取得する"""
-    return FusionAddinClient()
+    """FusionAddinClientのシングルトンインスタンスを取得する
+
+    同時に発行されたツールの呼び出しは、1回のリクエストにまとめてアドインに送信する。
+    """
+    return BatchingFusionClient()
+
+
+@asynccontextmanager
+async def lifespan(_server: FastMCP) -> AsyncIterator[None]:
+    """サーバー終了時にFusionアドインへの接続プールを閉じる"""
+    try:
+        yield
+    finally:
+        await get_fusion_addin_client().aclose()
 
 
 # FastMCP サーバーインスタンス
@@ -35,13 +49,14 @@ mcp = FastMCP(
 
 General guidance:
 - Run `health` first before using other Fusion tools.
-- Prefer `set_parameter` for simple parameter-driven edits.
+- Prefer `set_parameter` for simple parameter-driven edits, or `set_parameters` to change several at once.
 - Use `execute_code` for modeling, inspection, or automation that needs Fusion API access.
 - Use smaller steps when validation helps, or one script when the operation is tightly coupled.
 - In longer scripts, use `print()` for progress and key intermediate results.
 - After a failed run, use the error and current Fusion state to decide the next step. Do not assume the model is unchanged.
 - Use `get_viewport_screenshot` when visual verification helps, but not as a required step.
 - Ask the user before making major or ambiguous changes.""",
+    lifespan=lifespan,
 )
 
 
@@ -77,6 +92,7 @@ def handle_tool_error[**P, R](tool_func: Callable[P, R]) -> Callable[P, R]:
             ) from e
         except Exception as e:
             func_name = getattr(tool_func, "__name__", "tool")
+            logger.exception("Unexpected error in tool '%s'", func_name)
             error_msg = f"Failed to execute {func_name}: {e!s}"
             raise ToolError(format_error(UNKNOWN_ERROR["type"], error_msg)) from e
 
@@ -86,7 +102,6 @@ def handle_tool_error[**P, R](tool_func: Callable[P, R]) -> Callable[P, R]:
 @mcp.tool
 @handle_tool_error
 async def execute_code(
-    _ctx: Context,
     code: Annotated[
         str,
         Field(
@@ -118,6 +133,7 @@ async def execute_code(
     - Use smaller steps when validation helps, or one script when the operation is tightly coupled.
     - In longer scripts, use `print()` for progress and key intermediate results.
     - If a run fails, use the error and current Fusion state before trying again. A failed run may have changed the model.
+    - A timeout or connection error does not mean the script did not run, even when other tool calls failed with the same error. Check the current Fusion state before retrying.
 
     Pre-initialized objects:
     - `adsk`: The root API module.
@@ -141,13 +157,11 @@ async def execute_code(
         {"code": code, "transaction_name": summary},
     )
 
-    if not result.get("success", False):
-        error_info = result.get("error", {})
-        error_type = error_info.get("type", "UnknownError")
-        error_msg = error_info.get("message", "An unknown error occurred")
-        raise ToolError(format_error(error_type, error_msg))
+    if not result.success:
+        error = result.error or FusionError()
+        raise ToolError(format_error(error.type, error.message))
 
-    output: str = result.get("result", "")
+    output: str = result.result or ""
     return output
 
 
@@ -168,38 +182,21 @@ async def get_viewport_screenshot() -> Image:
     """
     connection = get_fusion_addin_client()
 
-    # 一時ファイルを作成してスクリーンショットを保存
-    fd, filepath_str = tempfile.mkstemp(prefix="fusion_viewport_screenshot_", suffix=".png")
-    os.close(fd)  # パスだけ必要なので、ファイルディスクリプタは閉じる
-    filepath = Path(filepath_str)
+    # 画像データはレスポンスに含まれるので、MCPサーバー側ではファイルを扱わない
+    result = await connection.call_action("get_viewport_screenshot_inline")
 
-    try:
-        result = await connection.call_action(
-            "get_viewport_screenshot",
-            {"filepath": str(filepath)},
-        )
-
-        if not result.get("success", False):
-            error_info = result.get("error", {})
-            error_type = error_info.get("type", "UnknownError")
-            error_msg = error_info.get("message", "An unknown error occurred")
-            raise ToolError(format_error(error_type, error_msg))
-
-        if not Path.exists(filepath):
-            raise ToolError(
-                format_error(
-                    "FusionScreenshotError",
-                    f"Screenshot was not created by Fusion Add-in. This may indicate a permission issue or Fusion internal error. Please ask the user to check Fusion's file access permissions and try again. Expected file: {filepath}",
-                ),
-            )
+    if not result.success:
+        error = result.error or FusionError()
+        raise ToolError(format_error(error.type, error.message))
 
-        with Path.open(filepath, "rb") as f:
-            image_bytes = f.read()
+    try:
+        image_bytes = base64.b64decode(result.result["png_base64"], validate=True)
+    except (KeyError, TypeError, binascii.Error) as e:
+        raise ToolError(
+            format_error(RESPONSE_PARSE_ERROR["type"], RESPONSE_PARSE_ERROR["message"]),
+        ) from e
 
-        return Image(data=image_bytes)
-    finally:
-        # 一時ファイルを削除
-        await anyio.Path(filepath).unlink(missing_ok=True)
+    return Image(data=image_bytes)
 
 
 class FusionParameter(BaseModel):
@@ -210,6 +207,17 @@ class FusionParameter(BaseModel):
     comment: str = ""
 
 
+class ParameterUpdate(BaseModel):
+    param_name: str = Field(
+        description="The name of the parameter to modify. The parameter must already exist.",
+        min_length=1,
+    )
+    expression: str = Field(
+        description="The expression for the parameter's value, e.g. '10', '10 mm', or 'width / 2'.",
+        min_length=1,
+    )
+
+
 class HealthStatus(BaseModel):
     connected: bool
     service: str
@@ -251,12 +259,11 @@ async def list_user_parameters() -> list[FusionParameter]:
     connection = get_fusion_addin_client()
     result = await connection.call_action("get_user_parameters")
 
-    if not result.get("success", False):
-        error_type = result.get("error", {}).get("type", "UnknownError")
-        error_msg = result.get("error", {}).get("message", "An unknown error occurred")
-        raise ToolError(format_error(error_type, error_msg))
+    if not result.success:
+        error = result.error or FusionError()
+        raise ToolError(format_error(error.type, error.message))
 
-    params = [FusionParameter.model_validate(param) for param in result.get("result", [])]
+    params = [FusionParameter.model_validate(param) for param in result.result or []]
 
     return params
 
@@ -295,15 +302,50 @@ async def set_parameter(
         {"param_name": param_name, "expression": expression},
     )
 
-    if not result.get("success", False):
-        error_type = result.get("error", {}).get("type", "UnknownError")
-        error_msg = result.get("error", {}).get("message", "An unknown error occurred")
-        raise ToolError(format_error(error_type, error_msg))
+    if not result.success:
+        error = result.error or FusionError()
+        raise ToolError(format_error(error.type, error.message))
 
-    changed_param = FusionParameter.model_validate(result.get("result", {}))
+    changed_param = FusionParameter.model_validate(result.result or {})
     return changed_param
 
 
+@mcp.tool
+@handle_tool_error
+async def set_parameters(
+    updates: Annotated[
+        list[ParameterUpdate],
+        Field(
+            description="Parameters to update, applied in order.",
+            min_length=1,
+        ),
+    ],
+) -> list[FusionParameter]:
+    """Update several parameters' expressions in Fusion in one call.
+
+    Use this tool instead of calling `set_parameter` repeatedly when changing multiple parameters.
+
+    - All parameter names are checked before any change is made.
+    - If applying an expression fails, the parameters before it remain updated.
+
+    Returns:
+    List of objects with updated parameter data: `name`, `value`, `unit`, `expression`, `comment`.
+
+    """
+    connection = get_fusion_addin_client()
+    result = await connection.call_action(
+        "set_parameters",
+        {"items": [update.model_dump() for update in updates]},
+    )
+
+    if not result.success:
+        error = result.error or FusionError()
+        raise ToolError(format_error(error.type, error.message))
+
+    changed_params = [FusionParameter.model_validate(param) for param in result.result or []]
+    return changed_params
+
+
 def main() -> None:
     mcp.run()
 